@@ -14,16 +14,17 @@ import logging
 import sys
 import os
 import re
-import json
 import collections
+import functools
+import hashlib
 import mimetypes
-import codecs
 import argparse
-import urllib
+from urllib.parse import quote_plus
 import webbrowser
-import requests
-import markdown
-import markdown2
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import httpx
+from markdown_it import MarkdownIt
 import convert
 
 from datetime import datetime
@@ -58,6 +59,9 @@ PARSER.add_argument('-d', '--delete', action='store_true', default=False,
                     help='Use this option to delete the page instead of create it.')
 PARSER.add_argument('-l', '--loglevel', default='INFO',
                     help='Use this option to set the log verbosity.')
+PARSER.add_argument('-f', '--force', action='store_true', default=False,
+                    help='Use this option to upload even if the markdown source is unchanged '
+                         'since the last upload.')
 PARSER.add_argument('-s', '--simulate', action='store_true', default=False,
                     help='Use this option to only show conversion result.')
 PARSER.add_argument('-v', '--version', type=int, action='store', default=1,
@@ -80,6 +84,9 @@ ARGS = PARSER.parse_args()
 try:
     # Set log level
     LOGGER.setLevel(getattr(logging, ARGS.loglevel.upper(), None))
+    # httpx logs every request at INFO; only show those lines when debugging
+    logging.getLogger('httpx').setLevel(logging.WARNING if LOGGER.level > logging.DEBUG
+                                        else LOGGER.level)
 
     MARKDOWN_FILE = ARGS.markdownFile
     SPACE_KEY = ARGS.spacekey
@@ -90,6 +97,7 @@ try:
     NOSSL = ARGS.nossl
     DELETE = ARGS.delete
     SIMULATE = ARGS.simulate
+    FORCE = ARGS.force
     VERSION = ARGS.version
     MARKDOWN_SOURCE = ARGS.markdownsrc
     LABELS = ARGS.labels
@@ -126,13 +134,82 @@ try:
         sys.exit(1)
 
     if NOSSL:
-        CONFLUENCE_API_URL.replace('https://', 'http://')
+        CONFLUENCE_API_URL = CONFLUENCE_API_URL.replace('https://', 'http://')
 
 except Exception as err:
     LOGGER.error('\n\nException caught:\n%s ', err)
     LOGGER.error('\nFailed to process command line arguments. Exiting.')
     sys.exit(1)
 
+# Folder that image and attachment paths are relative to
+SOURCE_FOLDER = os.path.dirname(os.path.abspath(MARKDOWN_FILE))
+
+# Shared HTTP/2 client so that all API calls, including concurrent ones, share pooled connections.
+# Redirects are followed, no timeout is applied and a REQUESTS_CA_BUNDLE is honoured, as was the
+# case with requests.
+CLIENT = httpx.Client(http2=True, auth=(USERNAME, API_KEY), follow_redirects=True, timeout=None,
+                      verify=os.getenv('REQUESTS_CA_BUNDLE') or True,
+                      limits=httpx.Limits(max_connections=10, max_keepalive_connections=10))
+
+# Content type for JSON request bodies; not set on the client so multipart uploads keep their own
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Lookup results returned by get_page and get_attachment
+PageInfo = collections.namedtuple('PageInfo', ['id', 'version', 'link', 'properties'])
+AttachmentInfo = collections.namedtuple('AttachmentInfo', ['id'])
+
+# Markdown renderer, built once; langPrefix is cleared so code blocks keep a bare language class
+MARKDOWN_RENDERER = MarkdownIt('commonmark', {'langPrefix': ''}).enable('table')
+
+# Content property holding the hash of the markdown source of the last upload
+SOURCE_HASH_PROPERTY = 'md2conf_sha'
+
+# We retrieve content property values as part of page content to make sure we are able to update
+# them later; the source hash property is always requested since main() adds it to PROPERTIES
+PROPERTIES_EXPAND = ''.join(',metadata.properties.%s' % key
+                            for key in dict.fromkeys(list(PROPERTIES) + [SOURCE_HASH_PROPERTY]))
+
+# Invariant payload fragments shared by every create/update request
+SPACE = {'key': SPACE_KEY}
+EDITOR_PROPERTIES = {'editor': {'value': 'v%d' % VERSION}}
+
+# In-process lookup caches, keyed by (title, space key, property keys) and (page id, filename)
+_PAGE_CACHE = {}
+_ATTACHMENT_CACHE = {}
+
+# Precompiled patterns used when post-processing the converted html
+_IMG_RE = re.compile(r'<img([^>]*?)/>')
+_IMG_SRC_RE = re.compile(r'src="([^"]*)"')
+_IMG_ALT_RE = re.compile(r'alt="([^"]*)"')
+_HTTP_RE = re.compile(r'http')
+_HEADER_RE = re.compile(r'<h\d+>(.*?)</h\d+>', re.DOTALL)
+_LINK_RE = re.compile(r'<a href="(#[^"]+)">(.+?)</a>')
+
+# Translation table removing whitespace from header and title anchors. It covers every character
+# str.split() treats as whitespace, including the non-breaking space markdown-it emits for &nbsp;;
+# none lies beyond U+3000 (ideographic space), so the scan stops there.
+_WS_DEL = str.maketrans('', '', ''.join(chr(c) for c in range(0x3001) if chr(c).isspace()))
+
+# Load the mime type database once up front rather than on the first upload
+mimetypes.init()
+
+# Number of attachments uploaded concurrently; kept within the client's connection limit
+UPLOAD_WORKERS = 8
+
+# Number of content property updates sent concurrently
+PROPERTY_WORKERS = 4
+
+
+def response_json(response):
+    """
+    Decode a JSON response body straight from the raw bytes
+
+    :param response: http response
+    :return: decoded data
+    """
+    return orjson.loads(response.content)
+
+
 def get_page(title):
     """
      Retrieve page details by title
@@ -140,24 +217,21 @@ def get_page(title):
     :param title: page tile
     :return: Confluence page info
     """
-    LOGGER.info('\tRetrieving page information: %s', title)
-    url = '%s/rest/api/content?title=%s&spaceKey=%s&expand=version,ancestors' % (
-        CONFLUENCE_API_URL, urllib.parse.quote_plus(title), SPACE_KEY)
-
-    # We retrieve content property values as part of page content
-    # to make sure we are able to update them later
-    if PROPERTIES:
-        url = '%s,%s' % (url, ','.join("metadata.properties.%s" % v for v in PROPERTIES.keys()))
+    cache_key = (title, SPACE_KEY, tuple(PROPERTIES))
+    if cache_key in _PAGE_CACHE:
+        LOGGER.debug('Page information for %s found in cache', title)
+        return _PAGE_CACHE[cache_key]
 
-    session = requests.Session()
-    session.auth = (USERNAME, API_KEY)
+    LOGGER.info('\tRetrieving page information: %s', title)
+    url = '%s/rest/api/content?title=%s&spaceKey=%s&expand=version,ancestors%s' % (
+        CONFLUENCE_API_URL, quote_plus(title), SPACE_KEY, PROPERTIES_EXPAND)
 
-    response = session.get(url)
+    response = CLIENT.get(url)
 
     # Check for errors
     try:
         response.raise_for_status()
-    except requests.RequestException as err:
+    except httpx.HTTPStatusError as err:
         LOGGER.error('err.response: %s', err)
         if response.status_code == 404:
             LOGGER.error('Error: Page not found. Check the following are correct:')
@@ -167,31 +241,41 @@ def get_page(title):
             LOGGER.error('Error: %d - %s', response.status_code, response.content)
         sys.exit(1)
 
-    data = response.json()
+    data = response_json(response)
 
-    LOGGER.debug("data: %s", str(data))
+    LOGGER.debug("data: %s", data)
 
-    if len(data[u'results']) >= 1:
-        page_id = data[u'results'][0][u'id']
-        version_num = data[u'results'][0][u'version'][u'number']
-        link = '%s%s' % (CONFLUENCE_API_URL, data[u'results'][0][u'_links'][u'webui'])
+    if len(data['results']) >= 1:
+        page_id = data['results'][0]['id']
+        version_num = data['results'][0]['version']['number']
+        link = '%s%s' % (CONFLUENCE_API_URL, data['results'][0]['_links']['webui'])
 
         try:
-            LOGGER.info(str(data))
-            properties = data[u'results'][0][u'metadata'][u'properties']
+            properties = data['results'][0]['metadata']['properties']
 
         except KeyError:
             # In case when page has no content properties we can simply ignore them
             properties = {}
             pass
 
-        page_info = collections.namedtuple('PageInfo', ['id', 'version', 'link', 'properties'])
-        page = page_info(page_id, version_num, link, properties)
+        page = PageInfo(page_id, version_num, link, properties)
+        _PAGE_CACHE[cache_key] = page
         return page
 
+    _PAGE_CACHE[cache_key] = False
     return False
 
 
+def invalidate_page(title):
+    """
+    Drop cached page details after the page has been created or modified
+
+    :param title: page title
+    :return: None
+    """
+    _PAGE_CACHE.pop((title, SPACE_KEY, tuple(PROPERTIES)), None)
+
+
 # Scan for images and upload as attachments if found
 def add_images(page_id, html):
     """
@@ -199,25 +283,29 @@ def add_images(page_id, html):
 
     :param page_id: Confluence page id
     :param html: html string
-    :return: html with modified image reference
+    :return: html with modified image reference, and whether all uploads succeeded
     """
-    source_folder = os.path.dirname(os.path.abspath(MARKDOWN_FILE))
-
-    for tag in re.findall('<img(.*?)\/>', html):
-        rel_path = re.search('src="(.*?)"', tag).group(1)
-        alt_text = re.search('alt="(.*?)"', tag).group(1)
-        abs_path = os.path.join(source_folder, rel_path)
-        basename = os.path.basename(rel_path)
-        upload_attachment(page_id, abs_path, alt_text)
-        if re.search('http.*', rel_path) is None:
-            if CONFLUENCE_API_URL.endswith('/wiki'):
-                html = html.replace('%s' % (rel_path),
-                                    '/wiki/download/attachments/%s/%s' % (page_id, basename))
-            else:
-                html = html.replace('%s' % (rel_path),
-                                    '/download/attachments/%s/%s' % (page_id, basename))
-    return html
+    if CONFLUENCE_API_URL.endswith('/wiki'):
+        download_prefix = '/wiki/download/attachments/%s/' % page_id
+    else:
+        download_prefix = '/download/attachments/%s/' % page_id
+    uploads = []
+
+    def rewrite(match):
+        attrs = match.group(1)
+        rel_path = _IMG_SRC_RE.search(attrs).group(1)
+        alt_text = _IMG_ALT_RE.search(attrs).group(1)
+        uploads.append((os.path.join(SOURCE_FOLDER, rel_path), alt_text))
+        if _HTTP_RE.search(rel_path) is not None:
+            return match.group(0)
+        new_path = download_prefix + os.path.basename(rel_path)
+        return '<img%s/>' % attrs.replace('src="%s"' % rel_path, 'src="%s"' % new_path)
 
+    # Rewrite every image source in one pass, then upload the collected files
+    html = _IMG_RE.sub(rewrite, html)
+
+    uploaded = upload_attachments(page_id, uploads)
+    return html, uploaded
 
 
 def add_attachments(page_id, files):
@@ -226,13 +314,46 @@ def add_attachments(page_id, files):
 
     :param page_id: Confluence page id
     :param files: list of files to attach to the given Confluence page
-    :return: None
+    :return: True if all uploads succeeded, False otherwise
     """
-    source_folder = os.path.dirname(os.path.abspath(MARKDOWN_FILE))
-
     if files:
-        for file in files:
-            upload_attachment(page_id, os.path.join(source_folder, file), '')
+        return upload_attachments(page_id,
+                                  [(os.path.join(SOURCE_FOLDER, file), '') for file in files])
+    return True
+
+
+def upload_attachments(page_id, uploads):
+    """
+    Upload several attachments concurrently
+
+    Confluence names attachments after the file basename, so files sharing a basename are uploaded
+    one after the other, letting the first create the attachment and the rest update it.
+    A failed upload is logged and does not prevent the remaining files from being uploaded.
+
+    :param page_id: Confluence page id
+    :param uploads: list of (file, comment) tuples
+    :return: True if all uploads succeeded, False otherwise
+    """
+    def upload(group):
+        succeeded = True
+        for file, comment in group:
+            try:
+                upload_attachment(page_id, file, comment)
+            except httpx.HTTPError as err:
+                LOGGER.error('Could not upload attachment %s: %s', file, err)
+                succeeded = False
+        return succeeded
+
+    # The same file referenced more than once is only uploaded once
+    groups = {}
+    for file, comment in uploads:
+        group = groups.setdefault(os.path.basename(file), {})
+        group.setdefault(file, (file, comment))
+    if not groups:
+        return True
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        return all(list(executor.map(upload, (group.values() for group in groups.values()))))
 
 
 def add_local_refs(page_id, title, html):
@@ -264,18 +385,18 @@ def add_local_refs(page_id, title, html):
 
     LOGGER.info('Converting confluence local links...')
 
-    headers = re.findall(r'<h\d+>(.*?)</h\d+>', html, re.DOTALL)
+    headers = _HEADER_RE.findall(html)
     if headers:
         headers_map = {}
         headers_count = {}
 
         for header in headers:
-            key = ref_prefix + slug(header, True)
+            key = ref_prefix + convert.slug(header, True)
 
             if VERSION == 1:
-                value = ''.join(header.split())
+                value = header.translate(_WS_DEL)
             if VERSION == 2:
-                value = slug(header, False)
+                value = convert.slug(header, False)
 
             if key in headers_map:
                 alt_count = headers_count[key]
@@ -289,24 +410,25 @@ def add_local_refs(page_id, title, html):
                 headers_map[key] = value
                 headers_count[key] = 1
 
-        links = re.findall(r'<a href="#.+?">.+?</a>', html)
-        if links:
-            for link in links:
-                matches = re.search(r'<a href="(#.+?)">(.+?)</a>', link)
-                ref = matches.group(1)
-                alt = matches.group(2)
+        # The page uri is the same for every link, only the anchor differs
+        base_uri = '%s/spaces/%s/pages/%s/%s' % (CONFLUENCE_API_URL, SPACE_KEY, page_id,
+                                                 '+'.join(title.split()))
+        if VERSION == 1:
+            anchor_prefix = '%s#%s-' % (base_uri, title.translate(_WS_DEL))
+        if VERSION == 2:
+            anchor_prefix = '%s#' % base_uri
 
-                result_ref = headers_map[ref]
+        def replace_link(matches):
+            ref = matches.group(1)
+            alt = matches.group(2)
 
-                if result_ref:
-                    base_uri = '%s/spaces/%s/pages/%s/%s' % (CONFLUENCE_API_URL, SPACE_KEY, page_id, '+'.join(title.split()))
-                    if VERSION == 1:
-                        replacement_uri = '%s#%s-%s' % (base_uri, ''.join(title.split()), result_ref)
-                    if VERSION == 2:
-                        replacement_uri = '%s#%s' % (base_uri, result_ref)
+            result_ref = headers_map.get(ref)
+            if not result_ref:
+                return matches.group(0)
 
-                    replacement = '<a href="%s" title="%s">%s</a>' % (replacement_uri, alt, alt)
-                    html = html.replace(link, replacement)
+            return '<a href="%s%s" title="%s">%s</a>' % (anchor_prefix, result_ref, alt, alt)
+
+        html = _LINK_RE.sub(replace_link, html)
 
     return html
 
@@ -324,13 +446,26 @@ def create_page(title, body, ancestors):
 
     url = '%s/rest/api/content/' % CONFLUENCE_API_URL
 
-    session = requests.Session()
-    session.auth = (USERNAME, API_KEY)
-    session.headers.update({'Content-Type': 'application/json'})
+    # Populate properties dictionary with initial property values
+    properties = {key: {"key": key, "version": 1, "value": value}
+                  for key, value in PROPERTIES.items() if key != SOURCE_HASH_PROPERTY}
+
+    img_check = _IMG_RE.search(body)
+    local_ref_check = _LINK_RE.search(body)
+    needs_update = img_check or local_ref_check or properties or ATTACHMENTS or LABELS
+
+    # A page needing no follow-up update is complete once created, so the source hash can be
+    # created with it; otherwise update_page records it once the update has succeeded
+    page_properties = dict(EDITOR_PROPERTIES)
+    if needs_update:
+        properties[SOURCE_HASH_PROPERTY] = {"key": SOURCE_HASH_PROPERTY, "version": 1,
+                                            "value": PROPERTIES[SOURCE_HASH_PROPERTY]}
+    else:
+        page_properties[SOURCE_HASH_PROPERTY] = {'value': PROPERTIES[SOURCE_HASH_PROPERTY]}
 
     new_page = {'type': 'page', \
                'title': title, \
-               'space': {'key': SPACE_KEY}, \
+               'space': SPACE, \
                'body': { \
                    'storage': { \
                        'value': body, \
@@ -338,43 +473,31 @@ def create_page(title, body, ancestors):
                        } \
                    }, \
                'ancestors': ancestors, \
-               'metadata': { \
-                   'properties': { \
-            	  	     'editor': { \
-            	  		       'value': 'v%d' % VERSION \
-            	  	         } \
-              	       } \
-                   } \
+               'metadata': {'properties': page_properties} \
                }
 
-    LOGGER.debug("data: %s", json.dumps(new_page))
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("data: %s", orjson.dumps(new_page).decode())
 
-    response = session.post(url, data=json.dumps(new_page))
+    response = CLIENT.post(url, content=orjson.dumps(new_page), headers=JSON_HEADERS)
     try:
         response.raise_for_status()
-    except requests.exceptions.HTTPError as excpt:
+    except httpx.HTTPStatusError as excpt:
         LOGGER.error("error: %s - %s", excpt, response.content)
         exit(1)
 
     if response.status_code == 200:
-        data = response.json()
-        space_name = data[u'space'][u'name']
-        page_id = data[u'id']
-        version = data[u'version'][u'number']
-        link = '%s%s' % (CONFLUENCE_API_URL, data[u'_links'][u'webui'])
+        invalidate_page(title)
+        data = response_json(response)
+        space_name = data['space']['name']
+        page_id = data['id']
+        version = data['version']['number']
+        link = '%s%s' % (CONFLUENCE_API_URL, data['_links']['webui'])
 
         LOGGER.info('Page created in %s with ID: %s.', space_name, page_id)
         LOGGER.info('URL: %s', link)
 
-        # Populate properties dictionary with initial property values
-        properties = {}
-        if PROPERTIES:
-            for key in PROPERTIES:
-                properties[key] = {"key": key, "version": 1, "value": PROPERTIES[key]}
-
-        img_check = re.search('<img(.*?)\/>', body)
-        local_ref_check = re.search('<a href="(#.+?)">(.+?)</a>', body)
-        if img_check or local_ref_check or properties or ATTACHMENTS or LABELS:
+        if needs_update:
             LOGGER.info('\tAttachments, local references, content properties or labels found, update procedure called.')
             update_page(page_id, title, body, version, ancestors, properties, ATTACHMENTS)
         else:
@@ -395,11 +518,7 @@ def delete_page(page_id):
     LOGGER.info('Deleting page...')
     url = '%s/rest/api/content/%s' % (CONFLUENCE_API_URL, page_id)
 
-    session = requests.Session()
-    session.auth = (USERNAME, API_KEY)
-    session.headers.update({'Content-Type': 'application/json'})
-
-    response = session.delete(url)
+    response = CLIENT.delete(url)
     response.raise_for_status()
 
     if response.status_code == 204:
@@ -423,23 +542,19 @@ def update_page(page_id, title, body, version, ancestors, properties, attachment
     LOGGER.info('Updating page...')
 
     # Add images and attachments
-    body = add_images(page_id, body)
-    add_attachments(page_id, attachments)
+    body, images_uploaded = add_images(page_id, body)
+    attachments_uploaded = add_attachments(page_id, attachments)
 
     # Add local references
     body = add_local_refs(page_id, title, body)
 
     url = '%s/rest/api/content/%s' % (CONFLUENCE_API_URL, page_id)
 
-    session = requests.Session()
-    session.auth = (USERNAME, API_KEY)
-    session.headers.update({'Content-Type': 'application/json'})
-
     page_json = { \
         "id": page_id, \
         "type": "page", \
         "title": title, \
-        "space": {"key": SPACE_KEY}, \
+        "space": SPACE, \
         "body": { \
             "storage": { \
                 "value": body, \
@@ -463,28 +578,46 @@ def update_page(page_id, title, body, version, ancestors, properties, attachment
 
         page_json['metadata']['labels'] = labels
 
-    response = session.put(url, data=json.dumps(page_json))
+    response = CLIENT.put(url, content=orjson.dumps(page_json), headers=JSON_HEADERS)
     response.raise_for_status()
 
     if response.status_code == 200:
-        data = response.json()
-        link = '%s%s' % (CONFLUENCE_API_URL, data[u'_links'][u'webui'])
+        invalidate_page(title)
+        data = response_json(response)
+        link = '%s%s' % (CONFLUENCE_API_URL, data['_links']['webui'])
 
         LOGGER.info("Page updated successfully.")
         LOGGER.info('URL: %s', link)
 
-        if properties:
+        def update_property(key):
+            prop_url = '%s/property/%s' % (url, key)
+            prop_json = {"key": key, "version": {"number": properties[key]["version"]},
+                         "value": properties[key]["value"]}
+
+            prop_response = CLIENT.put(prop_url, content=orjson.dumps(prop_json),
+                                       headers=JSON_HEADERS)
+            prop_response.raise_for_status()
+
+            if prop_response.status_code == 200:
+                LOGGER.info("\tUpdated property %s", key)
+
+        other_properties = [key for key in properties if key != SOURCE_HASH_PROPERTY]
+        if other_properties:
             LOGGER.info("Updating page content properties...")
 
-            for key in properties:
-                prop_url = '%s/property/%s' % (url, key)
-                prop_json = {"key": key, "version": {"number": properties[key][u"version"]}, "value": properties[key][u"value"]}
+            # Properties are independent of each other, so send them in parallel
+            # over the shared client
+            with ThreadPoolExecutor(max_workers=PROPERTY_WORKERS) as executor:
+                list(executor.map(update_property, other_properties))
 
-                response = session.put(prop_url, data=json.dumps(prop_json))
-                response.raise_for_status()
+        if not (images_uploaded and attachments_uploaded):
+            LOGGER.error("Some attachments could not be uploaded.")
+            sys.exit(1)
 
-                if response.status_code == 200:
-                    LOGGER.info("\tUpdated property %s", key)
+        # The source hash is only recorded once everything else has succeeded,
+        # so that a failed upload is retried on the next run
+        if SOURCE_HASH_PROPERTY in properties:
+            update_property(SOURCE_HASH_PROPERTY)
 
         if GO_TO_PAGE:
             webbrowser.open(link)
@@ -500,24 +633,37 @@ def get_attachment(page_id, filename):
     :param filename: attachment filename
     :return: attachment info in case of success, False otherwise
     """
-    url = '%s/rest/api/content/%s/child/attachment?filename=%s' % (CONFLUENCE_API_URL, page_id, filename)
+    cache_key = (page_id, filename)
+    if cache_key in _ATTACHMENT_CACHE:
+        return _ATTACHMENT_CACHE[cache_key]
 
-    session = requests.Session()
-    session.auth = (USERNAME, API_KEY)
+    url = '%s/rest/api/content/%s/child/attachment?filename=%s' % (CONFLUENCE_API_URL, page_id, filename)
 
-    response = session.get(url)
+    response = CLIENT.get(url)
     response.raise_for_status()
-    data = response.json()
+    data = response_json(response)
 
-    if len(data[u'results']) >= 1:
-        att_id = data[u'results'][0]['id']
-        att_info = collections.namedtuple('AttachmentInfo', ['id'])
-        attr_info = att_info(att_id)
+    if len(data['results']) >= 1:
+        att_id = data['results'][0]['id']
+        attr_info = AttachmentInfo(att_id)
+        _ATTACHMENT_CACHE[cache_key] = attr_info
         return attr_info
 
+    _ATTACHMENT_CACHE[cache_key] = False
     return False
 
 
+@functools.lru_cache(maxsize=64)
+def _guess_content_type(extension):
+    """
+    Guess the mime type for a file extension, cached per extension
+
+    :param extension: file extension including the leading dot
+    :return: mime type or None if unknown
+    """
+    return mimetypes.guess_type('file%s' % extension)[0]
+
+
 def upload_attachment(page_id, file, comment):
     """
     Upload an attachement
@@ -527,38 +673,54 @@ def upload_attachment(page_id, file, comment):
     :param comment: attachment comment
     :return: boolean
     """
-    if re.search('http.*', file):
+    if _HTTP_RE.search(file):
         return False
 
-    content_type = mimetypes.guess_type(file)[0]
+    content_type = _guess_content_type(os.path.splitext(file)[1])
     filename = os.path.basename(file)
 
     if not os.path.isfile(file):
         LOGGER.error('File %s cannot be found --> skip ', file)
         return False
 
-    file_to_upload = {
-        'comment': comment,
-        'file': (filename, open(file, 'rb'), content_type, {'Expires': '0'})
-    }
-
     attachment = get_attachment(page_id, filename)
     if attachment:
         url = '%s/rest/api/content/%s/child/attachment/%s/data' % (CONFLUENCE_API_URL, page_id, attachment.id)
     else:
         url = '%s/rest/api/content/%s/child/attachment/' % (CONFLUENCE_API_URL, page_id)
 
-    session = requests.Session()
-    session.auth = (USERNAME, API_KEY)
-    session.headers.update({'X-Atlassian-Token': 'no-check'})
-
     LOGGER.info('\tUploading attachment %s...', filename)
 
-    response = session.post(url, files=file_to_upload)
+    # httpx streams the multipart body from the open file rather than buffering it in memory
+    with open(file, 'rb') as file_handle:
+        file_to_upload = {'file': (filename, file_handle, content_type, {'Expires': '0'})}
+
+        response = CLIENT.post(url, data={'comment': comment}, files=file_to_upload,
+                               headers={'X-Atlassian-Token': 'no-check'})
     response.raise_for_status()
 
+    if not attachment:
+        # Remember the id of the newly created attachment so later uploads of it update it in place
+        results = response_json(response).get('results', [])
+        if results:
+            _ATTACHMENT_CACHE[(page_id, filename)] = AttachmentInfo(results[0]['id'])
+        else:
+            _ATTACHMENT_CACHE.pop((page_id, filename), None)
+
     return True
 
+def source_digest(text):
+    """
+    Hash the markdown source together with the options that shape the uploaded page
+
+    :param text: markdown source
+    :return: sha256 hex digest
+    """
+    options = repr((ANCESTOR, sorted(LABELS), sorted(PROPERTIES.items()), ATTACHMENTS,
+                    VERSION, CONTENTS, MARKDOWN_SOURCE, SHA_TAG, SCM_PREFIX))
+    return hashlib.sha256((text + options).encode('utf-8')).hexdigest()
+
+
 def add_header(html):
     if (SHA_TAG and SCM_PREFIX):
         timestamp = datetime.strftime(datetime.now(), '%c')
@@ -583,16 +745,18 @@ def main():
     LOGGER.info('Markdown file:\t%s', MARKDOWN_FILE)
     LOGGER.info('Space Key:\t%s', SPACE_KEY)
 
-    with open(MARKDOWN_FILE, 'r') as mdfile:
-        title = mdfile.readline().lstrip('#').strip()
-        mdfile.seek(0)
+    with open(MARKDOWN_FILE, 'r', encoding='utf-8') as mdfile:
+        text = mdfile.read()
+
+    title = text.split('\n', 1)[0].lstrip('#').strip()
 
     LOGGER.info('Title:\t\t%s', title)
 
-    with codecs.open(MARKDOWN_FILE, 'r', 'utf-8') as mdfile:
-        html = markdown2.markdown(mdfile.read(), extras=["fenced-code-blocks"])
+    html = MARKDOWN_RENDERER.render(text)
 
-    html = '\n'.join(html.split('\n')[1:])
+    # Drop the first line, which holds the page title
+    first_newline = html.find('\n')
+    html = html[first_newline + 1:] if first_newline != -1 else ''
 
     html = convert.convert_info_macros(html)
     html = convert.convert_comment_block(html)
@@ -615,6 +779,9 @@ def main():
         LOGGER.info("Simulate mode is active - stop processing here.")
         sys.exit(0)
 
+    # Store the source hash alongside the page so that unchanged sources can be skipped next time
+    PROPERTIES[SOURCE_HASH_PROPERTY] = source_digest(text)
+
     LOGGER.info('Checking if Atlas page exists...')
     page = get_page(title)
 
@@ -622,6 +789,12 @@ def main():
         delete_page(page.id)
         sys.exit(1)
 
+    stored_hash = page.properties.get(SOURCE_HASH_PROPERTY, {}).get('value') if page else None
+    if page and not FORCE and stored_hash == PROPERTIES[SOURCE_HASH_PROPERTY]:
+        LOGGER.info('Page is unchanged since the last upload - skipping update.')
+        LOGGER.info('URL: %s', page.link)
+        sys.exit(0)
+
     if ANCESTOR:
         parent_page = get_page(ANCESTOR)
         if parent_page:
@@ -634,13 +807,11 @@ def main():
 
     if page:
         # Populate properties dictionary with updated property values
-        properties = {}
-        if PROPERTIES:
-            for key in PROPERTIES:
-                if key in page.properties:
-                    properties[key] = {"key": key, "version": page.properties[key][u'version'][u'number'] + 1, "value": PROPERTIES[key]}
-                else:
-                    properties[key] = {"key": key, "version": 1, "value": PROPERTIES[key]}
+        properties = {key: {"key": key,
+                            "version": (page.properties[key]['version']['number'] + 1
+                                        if key in page.properties else 1),
+                            "value": value}
+                      for key, value in PROPERTIES.items()}
 
         update_page(page.id, title, html, page.version, ancestors, properties, ATTACHMENTS)
     else: